@@ -1,6 +1,8 @@
 from io import StringIO
-import os, re, argparse, sys, rtoml
-from subprocess import Popen, run, CompletedProcess
+import os, re, argparse, sys, hashlib
+from subprocess import DEVNULL, PIPE, Popen, run, CompletedProcess
+from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
 from enum import IntFlag
 from pathlib import Path
 from typing import TextIO
@@ -12,6 +14,16 @@ class Action(IntFlag):
     THIRD = 4
 
 TEMP_FILE = "_run_mypy_temp.toml"
+FOUND_ERRORS_RE = re.compile(r"Found \d+ errors?")
+# Severity tag of a mypy message line ("file:line:col: error: ...").
+# Searched rather than matched because MYPY_FORCE_COLOR wraps the tag in escape codes.
+SEVERITY_RE = re.compile(r"(error|warning|note):")
+# Output is captured, so colors have to be forced
+MYPY_ENV = {**os.environ, "MYPY_FORCE_COLOR": "1"}
+# The runs are concurrent, and mypy's cache isn't safe for concurrent writers:
+# the first run (dmypy) uses the default .mypy_cache, the others get their own
+SECOND_RUN_CACHE_DIR = os.path.join(".mypy_cache", "second_run")
+THIRD_RUN_CACHE_DIR = os.path.join(".mypy_cache", "third_run")
 NEW_EXCLUDE = r'build/.*|tests/(v2/)?python_parser/(data|parser_cache)/.*|tests/legacy/demo\.py|src/stde/pegen/v2/parser_old\.py'
 
 description = f"""\
@@ -43,8 +55,56 @@ RESET = colorama.Fore.RESET
 
 # Exact code will change if type check flagging strategy for grammar_parser_v2.py changes
 def compile_toml():
-    #data = rtoml.load("pyproject.toml")["tool"]["mypy"]
-    data = rtoml.load(Path(__file__).parent / "pyproject.toml")["tool"]["mypy"]
+    pyproject = Path(__file__).parent / "pyproject.toml"
+    source = pyproject.read_bytes()
+    # The temp file is only rewritten when its inputs (including this script) change,
+    # which also keeps its mtime stable
+    script = Path(__file__).read_bytes()
+    header = f"# {hashlib.blake2b(source + NEW_EXCLUDE.encode() + script).hexdigest()}\n"
+    try:
+        with open(TEMP_FILE, encoding="utf-8") as f:
+            if f.readline() == header:
+                return
+    except FileNotFoundError:
+        pass
+    text = source.decode("utf-8")
+    patched = patch_toml(mypy_tables(text))
+    if patched is None:
+        import rtoml
+        patched = rtoml.dumps({"tool": {"mypy": patch_toml_data(rtoml.loads(text))}})
+    Path(TEMP_FILE).write_text(header + patched, encoding="utf-8")
+
+# Fast path: patch pyproject.toml textually instead of round-tripping it through rtoml.
+# Both paths write only the [tool.mypy] table (with its [[tool.mypy.overrides]]).
+# The textual path expects every table header to start a line and no other line to start
+# with "[", the `exclude` line of [tool.mypy] and the `follow_imports` line of
+# the [[tool.mypy.overrides]] section for stde.pegen.v2.grammar_parser to be
+# single lines, and that section's `module` line to come first.
+TABLE_HEADER_RE = re.compile(r"^\[", re.M)
+MYPY_EXCLUDE_RE = re.compile(r"(^\[tool\.mypy\]\n(?:(?!\[)[^\n]*\n)*?)exclude = [^\n]*\n", re.M)
+FOLLOW_IMPORTS_RE = re.compile(
+    r'(^\[\[tool\.mypy\.overrides\]\]\nmodule = \["stde\.pegen\.v2\.grammar_parser"\]\n'
+    r"(?:(?!\[)[^\n]*\n)*?)follow_imports = [^\n]*\n", re.M)
+
+def mypy_tables(text):
+    """Return the [tool.mypy] table and its subtables from pyproject.toml text."""
+    starts = [m.start() for m in TABLE_HEADER_RE.finditer(text)] + [len(text)]
+    return "".join(text[start:end] for start, end in zip(starts, starts[1:])
+                   if text.startswith(("[tool.mypy]", "[tool.mypy.", "[[tool.mypy."), start))
+
+def patch_toml(text):
+    """Return patched pyproject.toml text, or None if the expected lines are not found."""
+    text, n = MYPY_EXCLUDE_RE.subn(lambda m: f"{m[1]}exclude = '{NEW_EXCLUDE}'\n", text)
+    if n != 1:
+        return None
+    text, n = FOLLOW_IMPORTS_RE.subn(lambda m: m[1], text)
+    if n != 1:
+        return None
+    return text
+
+def patch_toml_data(data):
+    """Slow path of patch_toml: patch parsed pyproject.toml, returning its [tool.mypy] table."""
+    data = data["tool"]["mypy"]
     # [[tool.mypy.overrides]]
     # module = ["stde.pegen.v2.grammar_parser"]
     for i, item in enumerate(data["overrides"]):
@@ -54,93 +114,145 @@ def compile_toml():
         assert False, "No section for stde.pegen.v2.grammar_parser matched"
     del data["overrides"][i]["follow_imports"]
     data["exclude"] = NEW_EXCLUDE
-    rtoml.dump({"tool": {"mypy": data}}, Path(TEMP_FILE))
+    return data
+
+def line_severity(line):
+    """Return "error", "warning" or "note" for a mypy message line, None otherwise.
+
+    Only the first tag after the "file:line:col: " prefix counts, so a note
+    whose message happens to contain "error:" is still classified as a note.
+    """
+    m = SEVERITY_RE.search(line, line.find(": ") + 1)
+    return m[1] if m else None
+
+def print_header(line, file=None):
+    print(f"{BOLD}{MAGENTA}{line}{RESET}{NORMAL}", file=file)
+
+def first_run(args, out, err):
+    # Note: Use mypy daemon for Action.FIRST only
+    print_header(f"== First run: excluding grammar_parser_v2.py", file=out)
+    # Reuse a running daemon (and its warm cache) instead of starting a new one
+    if run(["dmypy", "status"], stdout=DEVNULL, stderr=DEVNULL).returncode != 0:
+        proc = run(["dmypy", "start"], stdout=PIPE, stderr=PIPE, text=True)
+        out.write(proc.stdout)
+        err.write(proc.stderr)
+    # Crash is likely for first run. Not very likely for other runs. (??)
+    if run_a(args, out, err):
+        print_header(f"== Retry: First run: excluding grammar_parser_v2.py", file=out)
+        if run_a(args, out, err):
+            return f"{RED}{BOLD}Daemon crashed twice{RESET}{NORMAL}"
+    return None
 
-def print_header(line):
-    print(f"{BOLD}{MAGENTA}{line}{RESET}{NORMAL}")
+def second_run(args, out, err):
+    print_header(f"== Second run: just grammar_parser_v2.py, filtering likely false-positives", file=out)
+    compile_toml()
+    lines = run_lines(["mypy", "-m", "stde.pegen.v2.grammar_parser", f"--config-file={TEMP_FILE}",
+                       f"--cache-dir={SECOND_RUN_CACHE_DIR}"] + args.args, err)
+    nerrors = 0
+    nfiltered = dict.fromkeys(("error", "warning", "note", "other"), 0)
+    no_success = True
+    # Local aliases for the per-line loop
+    write = out.write
+    search_found = FOUND_ERRORS_RE.search
+    for line in lines:
+        severity = line_severity(line)
+        found = severity is None and search_found(line)
+        if "FAILURE" not in line and "NO_MATCH" not in line and not found:
+            write(line)
+            if severity == "error":
+                nerrors += 1
+        else:
+            if severity is not None:
+                nfiltered[severity] += 1
+            elif not found: # Abandon this line anyway
+                nfiltered["other"] += 1
+            if "Success:" in line:
+                no_success = False
+    print(f"{BOLD}Filtered {nfiltered["error"]} {"error" if nfiltered["error"] == 1 else "errors"}, "
+          f"{nfiltered["warning"]} {"warning" if nfiltered["warning"] == 1 else "warnings"}, "
+          f"{nfiltered["note"]} {"note" if nfiltered["note"] == 1 else "notes"}, "
+          f"{nfiltered["other"]} other lines{NORMAL}", file=out)
+    if nerrors:
+        print(f"{RED}{BOLD}Unfiltered {nerrors} "
+              f"{"error" if nerrors == 1 else "errors"}{RESET}{NORMAL}", file=out)
+    else:
+        if no_success:
+            print(f"{GREEN}{BOLD}Success{RESET}{NORMAL}", file=out)
+    #CompletedProcess(proc.args, proc.returncode, None, None).check_returncode()
+    return None
+
+def third_run(args, out, err):
+    print_header(f"== Third run: just grammar_parser_v2.py, not filtering likely false-positives", file=out)
+    cmd = ["mypy", "-m", "stde.pegen.v2.grammar_parser", f"--cache-dir={THIRD_RUN_CACHE_DIR}"] + args.args
+    if out is sys.stdout:
+        # Primary run: let mypy write to the terminal itself (and pick its own colors)
+        sys.stdout.flush()
+        run(cmd)
+    else:
+        proc = run(cmd, stdout=PIPE, stderr=PIPE, text=True)
+        out.write(proc.stdout)
+        err.write(proc.stderr)
+    return None
+
+PHASES = ((Action.FIRST, first_run), (Action.SECOND, second_run), (Action.THIRD, third_run))
+
+def run_phase(phase, args):
+    """Run a phase, returning its buffered stdout and stderr output and an optional exit message."""
+    out, err = StringIO(), StringIO()
+    error = phase(args, out, err)
+    return out.getvalue(), err.getvalue(), error
 
 def main(args):
     if args.action != 0:
         colorama.just_fix_windows_console()
         #RED = colorama.Fore.RED
-        if args.action & Action.FIRST:
-            # Note: Use mypy daemon for Action.FIRST only
-            print_header(f"== First run: excluding grammar_parser_v2.py")
-            run(["dmypy", "start"], stdout=sys.stdout, stderr=sys.stderr)
-            # Crash is likely for first run. Not very likely for other runs. (??)
-            if run_a(args):
-                print_header(f"== Retry: First run: excluding grammar_parser_v2.py")
-                if run_a(args):
-                    sys.exit(f"{RED}{BOLD}Daemon crashed twice{RESET}{NORMAL}")
-        if args.action & (Action.SECOND | Action.THIRD):
-            pass
-            # Needed for unknown reasons, might be dmypy bug
-            # ??
-            #run(["dmypy", "restart"], stdout=sys.stdout, stderr=sys.stderr)
-            #run(["dmypy", "kill"], stdout=sys.stdout, stderr=sys.stderr)
-            #run(["dmypy", "start"] + args.args, stdout=sys.stdout, stderr=sys.stderr)
-        if args.action & Action.SECOND:
-            print_header(f"== Second run: just grammar_parser_v2.py, filtering likely false-positives")
-            compile_toml()
-            r, w = os.pipe()
-            with os.fdopen(r, "r") as rf:
-                with os.fdopen(w, "w") as wf:
-                    Popen(["mypy", "-m", "stde.pegen.v2.grammar_parser", f"--config-file={TEMP_FILE}"] + args.args,
-                          stdout=wf, stderr=sys.stderr, env={"MYPY_FORCE_COLOR": "1"})
-                nerrors = 0
-                nfilterederrors = 0
-                nfilteredwarnings = 0
-                nfilterednotes = 0
-                nfilteredothers = 0
-                no_success = True
-                for line in rf:
-                    if "FAILURE" not in line and "NO_MATCH" not in line and not re.search(r"Found \d+ error", line):
-                        sys.stdout.write(line)
-                        if "error:" in line:
-                            nerrors += 1
-                    else:
-                        if "error:" in line:
-                            nfilterederrors += 1
-                        elif "warning:" in line:
-                            nfilteredwarnings += 1
-                        elif "note:" in line:
-                            nfilterednotes += 1
-                        elif not re.search(r"Found \d+ error", line): # Abandon this line anyway
-                            nfilteredothers += 1
-                        if "Success:" in line:
-                            no_success = False
-                print(f"{BOLD}Filtered {nfilterederrors} {"error" if nfilterederrors == 1 else "errors"}, "
-                      f"{nfilteredwarnings} {"warning" if nfilteredwarnings == 1 else "warnings"}, "
-                      f"{nfilterednotes} {"note" if nfilterednotes == 1 else "notes"}, "
-                      f"{nfilteredothers} other lines{NORMAL}")
-                if nerrors:
-                    print(f"{RED}{BOLD}Unfiltered {nerrors} "
-                          f"{"error" if nerrors == 1 else "errors"}{RESET}{NORMAL}")
-                else:
-                    if no_success:
-                        print(f"{GREEN}{BOLD}Success{RESET}{NORMAL}")
-            #CompletedProcess(proc.args, proc.returncode, None, None).check_returncode()
-        if args.action & Action.THIRD:
-            print_header(f"== Third run: just grammar_parser_v2.py, not filtering likely false-positives")
-            run(["mypy", "-m", "stde.pegen.v2.grammar_parser"] + args.args,
-                stdout=sys.stdout, stderr=sys.stderr)
+        # Needed for unknown reasons, might be dmypy bug
+        # ??
+        #run(["dmypy", "restart"], stdout=sys.stdout, stderr=sys.stderr)
+        #run(["dmypy", "kill"], stdout=sys.stdout, stderr=sys.stderr)
+        #run(["dmypy", "start"] + args.args, stdout=sys.stdout, stderr=sys.stderr)
+        primary, *others = [phase for action, phase in PHASES if args.action & action]
+        # The runs are independent subprocesses, so run them concurrently.
+        # The first run streams its output as it goes; the others buffer theirs,
+        # which is printed in run order once the first run is done.
+        with ThreadPoolExecutor(max_workers=len(others) or 1) as executor:
+            futures = [executor.submit(run_phase, phase, args) for phase in others]
+            error = primary(args, sys.stdout, sys.stderr)
+        # Print the output of every run before exiting on an error
+        errors = [] if error is None else [error]
+        for future in futures:
+            output, err_output, error = future.result()
+            sys.stdout.write(output)
+            sys.stdout.flush()
+            sys.stderr.write(err_output)
+            sys.stderr.flush()
+            if error is not None:
+                errors.append(error)
+        if errors:
+            sys.exit("\n".join(errors))
         if args.action & Action.SECOND:
             print_header("Use --third-only to run mypy on grammar_parser_v2.py without filtering")
             print_header("(but be prepared to manually handle false-positives)")
 
-def run_a(args):
-    r, w = os.pipe()
-    crashed = False
-    with os.fdopen(r, "r") as rf:
-        with os.fdopen(w, "w") as wf:
-            proc = Popen(["dmypy", "run", "--"] + args.args,
-                         stdout=sys.stdout, stderr=wf, env={"MYPY_FORCE_COLOR": "1"})
-        for line in rf:
-            if "Daemon crashed" in line:
-                crashed = True
-            sys.stderr.write(line)
+def run_lines(cmd, err):
+    """Run cmd with MYPY_ENV, yielding its stdout lines as they arrive.
+
+    Its stderr is copied to err by a thread meanwhile.
+    """
+    with Popen(cmd, stdout=PIPE, stderr=PIPE, text=True, env=MYPY_ENV) as proc:
+        copier = Thread(target=err.writelines, args=(proc.stderr,))
+        copier.start()
+        yield from proc.stdout
+        copier.join()
+
+def run_a(args, out, err):
+    # stderr is checked for a crash message, so it is only written once the run is done
+    stderr = StringIO()
+    out.writelines(run_lines(["dmypy", "run", "--"] + args.args, stderr))
+    err.write(stderr.getvalue())
+    crashed = "Daemon crashed" in stderr.getvalue()
     if crashed:
-        print(f"{RED}{BOLD}Daemon crashed{RESET}{NORMAL}")
+        print(f"{RED}{BOLD}Daemon crashed{RESET}{NORMAL}", file=out)
     return crashed
 
 if __name__ == "__main__":
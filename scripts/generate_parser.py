@@ -7,7 +7,6 @@ import shutil
 import subprocess
 import sys
 import os
-import colorama
 
 # Path configurations
 LEGACY_METAGRAMMAR = "src/stde/pegen/legacy/metagrammar.gram"
@@ -15,13 +14,6 @@ LEGACY_OUTPUT = "src/stde/pegen/legacy/grammar_parser.py"
 V2_METAGRAMMAR = "src/stde/pegen/v2/metagrammar.gram"
 V2_OUTPUT = "src/stde/pegen/v2/grammar_parser.py"
 
-RED = colorama.Fore.LIGHTRED_EX
-GREEN = colorama.Fore.LIGHTGREEN_EX
-WHITE = colorama.Fore.LIGHTWHITE_EX
-MAGENTA = colorama.Fore.MAGENTA
-BOLD = colorama.Style.BRIGHT
-NORMAL = colorama.Style.NORMAL
-RESET = colorama.Fore.RESET
 
 p = argparse.ArgumentParser(
     description="Generate grammar parser with backup functionality")
@@ -35,11 +27,45 @@ p.add_argument("args", nargs="*", # NOT argparse.REMAINDER! It's no good
                help="Arguments to pass to generator (precede with '--')")
 
 
-def backup_file(file_path):
-    """Create backup of file if it exists"""
+# From linux/fs.h
+FICLONE = 0x40049409
+
+
+def _reflink(src, dst):
+    """Try to make dst a copy-on-write clone of src. Returns whether it succeeded.
+
+    Note: A hard link can't be used instead because the generator truncates
+    and rewrites the output file in place, which would also change the backup.
+    """
+    try:
+        import fcntl
+    except ImportError:  # Windows
+        return False
+    try:
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    except OSError:  # Not supported by OS or filesystem
+        return False
+    shutil.copystat(src, dst)
+    return True
+
+
+def _maybe_stat(path):
+    """Return os.stat() result of path, or None if it can't be accessed
+    (like os.path.exists returning False)"""
+    try:
+        return os.stat(path)
+    except (OSError, ValueError):
+        return None
+
+
+def backup_file(file_path, size):
+    """Create backup of file if it exists. size is its size, for the log message"""
     backup_path = f"{file_path}.bak" #XXX:...
-    shutil.copy2(file_path, backup_path)
-    print(f"Backed up {file_path} -> {backup_path}")
+    # Cloning is a metadata-only operation where supported (e.g. Btrfs, XFS)
+    if not _reflink(file_path, backup_path):
+        shutil.copy2(file_path, backup_path)
+    print(f"Backed up {file_path} ({size} bytes) -> {backup_path}")
     return backup_path
 
 
@@ -50,6 +76,8 @@ def restore_backup(original_path, backup_path):
 
 
 def main(args):
+    import colorama
+    from colorama import Fore, Style
     colorama.just_fix_windows_console()
     if args.version == "legacy":
         metagrammar = LEGACY_METAGRAMMAR
@@ -61,15 +89,16 @@ def main(args):
         version_flag = "--v2"
     else:
         assert False, args.version
-    if not os.path.exists(metagrammar):
+    if _maybe_stat(metagrammar) is None:
         print(f"Error: Metagrammar file not found at {metagrammar}")
         return 1
 
-    if not os.path.exists(output):
+    out_st = _maybe_stat(output)
+    if out_st is None:
         print(f"Skipping backing up output file {output} as it doesn't exist")
         backup_path = None
     else:
-        backup_path = backup_file(output)
+        backup_path = backup_file(output, out_st.st_size)
     # Generate parser
     cmd = [sys.executable, "-m", "stde.pegen", metagrammar, "-o", output]
     if version_flag:
@@ -81,16 +110,16 @@ def main(args):
     cmd.extend(args.args)
     #raise
     for i in range(1, args.generations + 1):
-        print(f"{WHITE}{BOLD}Generation {i}/{args.generations}: {' '.join(cmd)}{RESET}{NORMAL}")
+        print(f"{Fore.LIGHTWHITE_EX}{Style.BRIGHT}Generation {i}/{args.generations}: {' '.join(cmd)}{Fore.RESET}{Style.NORMAL}")
         result = subprocess.run(cmd)
         if result.returncode:
-            print(f"{RED}{BOLD}Error: Generation {i} failed with code {result.returncode}{RESET}{NORMAL}")
+            print(f"{Fore.LIGHTRED_EX}{Style.BRIGHT}Error: Generation {i} failed with code {result.returncode}{Fore.RESET}{Style.NORMAL}")
             if backup_path:
                 restore_backup(output, backup_path)
             return result.returncode
         #XXX: Use first result as backup if backup_path initially None?
 
-    print(f"{GREEN}{BOLD}Generation successful!{RESET}{NORMAL}")
+    print(f"{Fore.LIGHTGREEN_EX}{Style.BRIGHT}Generation successful!{Fore.RESET}{Style.NORMAL}")
     return 0
 
 if __name__ == "__main__":
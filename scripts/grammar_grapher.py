@@ -21,7 +21,7 @@
 
 import argparse
 import sys
-from typing import Any, List
+from typing import Any, Callable, Dict, List, Set
 
 sys.path.insert(0, ".")
 
@@ -30,17 +30,20 @@ from stde.pegen.legacy.grammar import (
     Alt,
     Cut,
     Forced,
+    Gather,
     Grammar,
     Group,
-    Leaf,
-    Lookahead,
+    NegativeLookahead,
     TopLevelItem,
     NameLeaf,
     Opt,
-    Repeat,
+    PositiveLookahead,
+    Repeat0,
+    Repeat1,
     Rhs,
     Rule,
     ExternDecl,
+    StringLeaf,
 )
 
 argparser = argparse.ArgumentParser(
@@ -50,40 +53,52 @@ argparser = argparse.ArgumentParser(
 argparser.add_argument("grammar_file", help="The grammar file to graph")
 
 
+# Maps each item type to a function pushing its children onto the work stack.
+# Children are pushed in reverse so they are popped (and reported) in source order.
+_REF_DISPATCH: Dict[type, Callable[[Any, List[Any]], None]] = {
+    Alt: lambda item, stack: stack.extend(reversed(item.items)),
+    Cut: lambda item, stack: None,
+    Forced: lambda item, stack: stack.append(item.node),
+    Group: lambda item, stack: stack.append(item.rhs),
+    PositiveLookahead: lambda item, stack: stack.append(item.node),
+    NegativeLookahead: lambda item, stack: stack.append(item.node),
+    TopLevelItem: lambda item, stack: stack.append(item.item),
+    StringLeaf: lambda item, stack: None,
+    Opt: lambda item, stack: stack.append(item.node),
+    Repeat0: lambda item, stack: stack.append(item.node),
+    Repeat1: lambda item, stack: stack.append(item.node),
+    Gather: lambda item, stack: stack.append(item.node),
+    Rhs: lambda item, stack: stack.extend(reversed(item.alts)),
+    Rule: lambda item, stack: stack.append(item.rhs),
+}
+
+
+def _add_references(item: Any, add: Callable[[str], None]) -> None:
+    stack = [item]
+    while stack:
+        item = stack.pop()
+        handler = _REF_DISPATCH.get(type(item))
+        if handler is not None:
+            handler(item, stack)
+        elif isinstance(item, NameLeaf):
+            if item.value != "ENDMARKER":
+                add(item.value)
+        elif isinstance(item, ExternDecl):
+            add(item.name)
+        else:
+            raise RuntimeError(f"Unknown item: {type(item)}")
+
+
 def references_for_item(item: Any) -> List[Any]:
-    if isinstance(item, Alt):
-        return [_ref for _item in item.items for _ref in references_for_item(_item)]
-    elif isinstance(item, Cut):
-        return []
-    elif isinstance(item, Forced):
-        return references_for_item(item.node)
-    elif isinstance(item, Group):
-        return references_for_item(item.rhs)
-    elif isinstance(item, Lookahead):
-        return references_for_item(item.node)
-    elif isinstance(item, TopLevelItem):
-        return references_for_item(item.item)
-
-    # NOTE NameLeaf must be before Leaf
-    elif isinstance(item, NameLeaf):
-        if item.value == "ENDMARKER":
-            return []
-        return [item.value]
-    elif isinstance(item, Leaf):
-        return []
-
-    elif isinstance(item, Opt):
-        return references_for_item(item.node)
-    elif isinstance(item, Repeat):
-        return references_for_item(item.node)
-    elif isinstance(item, Rhs):
-        return [_ref for alt in item.alts for _ref in references_for_item(alt)]
-    elif isinstance(item, Rule):
-        return references_for_item(item.rhs)
-    elif isinstance(item, ExternDecl):
-        return [item.name]
-    else:
-        raise RuntimeError(f"Unknown item: {type(item)}")
+    refs: List[Any] = []
+    _add_references(item, refs.append)
+    return refs
+
+
+def references_set_for_item(item: Any) -> Set[str]:
+    refs: Set[str] = set()
+    _add_references(item, refs.add)
+    return refs
 
 
 def main() -> None:
@@ -95,9 +110,7 @@ def main() -> None:
         print("ERROR: Failed to parse grammar file", file=sys.stderr)
         sys.exit(1)
 
-    references = {}
-    for name, rule in grammar.rules.items():
-        references[name] = set(references_for_item(rule))
+    references = {name: references_set_for_item(rule) for name, rule in grammar.rules.items()}
 
     # Flatten the start node if has only a single reference
     root_node = "start"
@@ -106,15 +119,18 @@ def main() -> None:
             root_node = list(start)[0]
             del references["start"]
 
-    print("digraph g1 {")
-    print('\toverlap="scale";')  # Force twopi to scale the graph to avoid overlaps
-    print(f'\troot="{root_node}";')
+    out = [
+        "digraph g1 {",
+        '\toverlap="scale";',  # Force twopi to scale the graph to avoid overlaps
+        f'\troot="{root_node}";',
+    ]
     if start:
-        print(f"\t{root_node} [color=green, shape=circle]")
+        out.append(f"\t{root_node} [color=green, shape=circle]")
     for name, refs in references.items():
         if refs:  # Ignore empty sets
-            print(f"\t{name} -> {','.join(refs)};")
-    print("}")
+            out.append(f"\t{name} -> {','.join(refs)};")
+    out.append("}")
+    sys.stdout.write("\n".join(out) + "\n")
 
 
 if __name__ == "__main__":
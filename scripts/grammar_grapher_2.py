@@ -45,10 +45,9 @@ python scripts/grammar_grapher_2.py data/python.gram -s return_stmt --reverse-al
 # TODO: Tooltip descriptions of nodes, edges?
 
 import argparse
+import bisect
 import sys
-from typing import Iterable, Iterator, List, Set, Dict, Tuple
-from collections import deque
-from contextlib import contextmanager
+from typing import AbstractSet, Any, Callable, Iterable, List, Set, Dict, Tuple
 
 sys.path.insert(0, ".")
 
@@ -65,9 +64,9 @@ from stde.pegen.v2.grammar import (
 )
 
 #...
-TERMINALS_V1 = {"SOFT_KEYWORD", "NAME", "NUMBER", "STRING",
-                "FSTRING_START", "FSTRING_MIDDLE", "FSTRING_END", "OP", "TYPE_COMMENT",
-                "NEWLINE", "DEDENT", "INDENT", "ENDMARKER", "ASYNC", "AWAIT"}
+TERMINALS_V1 = frozenset({"SOFT_KEYWORD", "NAME", "NUMBER", "STRING",
+                          "FSTRING_START", "FSTRING_MIDDLE", "FSTRING_END", "OP", "TYPE_COMMENT",
+                          "NEWLINE", "DEDENT", "INDENT", "ENDMARKER", "ASYNC", "AWAIT"})
 
 DEFAULT_STYLE = """\
     overlap="scale"  // Force twopi to scale the graph to avoid overlaps
@@ -77,6 +76,10 @@ DEFAULT_STYLE = """\
 """
 
 
+# Marker pushed onto Visitor._stack below a rule's body
+_LEAVE_RULE = object()
+
+
 #@dataclass
 #class Item:
 #    string: str
@@ -84,24 +87,59 @@ DEFAULT_STYLE = """\
 
 
 class Visitor(GrammarVisitor):
-    def __init__(self, grammar: Grammar, terminals: Set[str],
+    def __init__(self, grammar: Grammar, terminals: AbstractSet[str],
                  include_invalid: bool = False,
-                 reverse_alts: bool = False, reverse_alt: bool = False):
+                 reverse_alts: bool = False, reverse_alt: bool = False,
+                 sort_edges: bool = False):
         self.grammar = grammar
         self.terminals = terminals
         self.include_invalid = include_invalid
         self.reverse_alts = reverse_alts
         self.reverse_alt = reverse_alt
+        self.sort_edges = sort_edges
         self.unordered_graph: Dict[str, Set[str]] = {}
         self.graph: Dict[str, List[str]] = {}
-        self._current_rule_name_stack: deque[str] = deque()
+        self._current_rule_name_stack: List[str] = []
+        # Pending nodes of visit(). Visitor methods push children here instead of
+        # recursing, so deep rule chains cost no Python frames (or RecursionError).
+        self._stack: List[Any] = []
         self.dfn_order: List[str] = []
-
-    @contextmanager
-    def in_rule(self, name: str) -> Iterator[None]:
-        self._current_rule_name_stack.append(name)
-        yield
-        self._current_rule_name_stack.pop()
+        # Type-keyed cache of visitor methods, so GrammarVisitor.visit's method name
+        # lookup is done once per node type rather than once per node.
+        # (Keyed lazily by type because legacy grammars use different node classes.)
+        self._dispatch: Dict[type, Callable[[Any], None]] = {}
+
+    def visit(self, node: Any) -> None:
+        """Visit node depth-first, in the same order as recursive visiting would."""
+        stack = self._stack
+        base = len(stack)
+        stack.append(node)
+        dispatch = self._dispatch
+        while len(stack) > base:
+            node = stack.pop()
+            if node is _LEAVE_RULE:
+                self._current_rule_name_stack.pop()
+                continue
+            try:
+                visitor = dispatch[type(node)]
+            except KeyError:
+                visitor = getattr(self, "visit_" + type(node).__name__, self.generic_visit)
+                dispatch[type(node)] = visitor
+            visitor(node)
+
+    def visit_all(self, nodes: Iterable[Any]) -> None:
+        """Queue nodes to be visited in order (by the running visit())."""
+        self._stack.extend(reversed(list(nodes)))
+
+    def generic_visit(self, node: Iterable[Any]) -> None:
+        # Same as GrammarVisitor.generic_visit (flattening lists), but queues the children
+        children: List[Any] = []
+        for value in node:
+            if isinstance(value, list):
+                children.extend(value)
+            else:
+                children.append(value)
+        self.visit_all(children)
 
     def init_name(self, name: str) -> None:
         self.unordered_graph[name] = set()
@@ -112,7 +150,10 @@ class Visitor(GrammarVisitor):
             current_rule_name = self._current_rule_name_stack[-1]
             if name not in self.unordered_graph[current_rule_name]:
                 self.unordered_graph[current_rule_name].add(name)
-                self.graph[current_rule_name].append(name)
+                if self.sort_edges:
+                    bisect.insort(self.graph[current_rule_name], name)
+                else:
+                    self.graph[current_rule_name].append(name)
 
     def visit_Rule(self, rule: Rule) -> None:
         if rule.name in self.unordered_graph:
@@ -122,14 +163,15 @@ class Visitor(GrammarVisitor):
         self.init_name(rule.name)
         self.dfn_order.append(rule.name)
         if rule.name not in self.terminals:
-            with self.in_rule(rule.name):
-                self.visit(rule.rhs)
+            self._current_rule_name_stack.append(rule.name)
+            self._stack.append(_LEAVE_RULE)
+            self._stack.append(rule.rhs)
 
     def visit_Rhs(self, rhs: Rhs) -> None:
-        self.visit(reversed(rhs.alts) if self.reverse_alts else rhs.alts)
+        self.visit_all(reversed(rhs.alts) if self.reverse_alts else rhs.alts)
 
     def visit_Alt(self, alt: Alt) -> None:
-        self.visit(reversed(alt.items) if self.reverse_alt else alt.items)
+        self.visit_all(reversed(alt.items) if self.reverse_alt else alt.items)
 
     def visit_NameLeaf(self, nameleaf: NameLeaf) -> None:
         if not self.include_invalid and nameleaf.value.startswith("invalid_"):
@@ -142,8 +184,8 @@ class Visitor(GrammarVisitor):
                                      else "(??)")
                 print(f"Warning: Unknown name {nameleaf.value} (in rule {current_rule_name})",
                       file=sys.stderr)
-            else:
-                self.visit(self.grammar[nameleaf.value])
+            elif nameleaf.value not in self.unordered_graph:  # Skip already visited rules
+                self._stack.append(self.grammar[nameleaf.value])
 
     def visit_ExternDecl(self, decl: ExternDecl) -> None:
         if not self.include_invalid and decl.name.startswith("invalid_"):
@@ -179,11 +221,12 @@ def main(args: argparse.Namespace) -> None:
         sys.exit(1)
 
     if args.terminals[0]:
-        terminals |= args.terminals[1]
+        terminals = terminals | args.terminals[1]
     else:
         terminals = args.terminals[1]
 
-    visitor = Visitor(grammar, terminals, args.include_invalid, args.reverse_alts, args.reverse_alt) #type:ignore #... Migrating
+    visitor = Visitor(grammar, terminals, args.include_invalid, args.reverse_alts, args.reverse_alt,
+                      args.canonical == "name_sort") #type:ignore #... Migrating
     if args.subgraph:
         visitor.visit(grammar[args.subgraph])
     else:
@@ -193,11 +236,10 @@ def main(args: argparse.Namespace) -> None:
     root_node = (args.subgraph if args.subgraph
                  else "start" if "start" in grammar.items
                  else None)
-    print("digraph g1 {")
-    print(args.global_style)
+    out = ["digraph g1 {", args.global_style]
     if root_node:
-        print(f'    root="{root_node}";')
-        print(f'    {root_node} [color=green, fontcolor="#427934", shape=circle, fillcolor=white]')
+        out.append(f'    root="{root_node}";')
+        out.append(f'    {root_node} [color=green, fontcolor="#427934", shape=circle, fillcolor=white]')
 
     items: Iterable[Tuple[str, Iterable[str]]] #Settle mypy
     if args.canonical == "dfn_order":
@@ -208,27 +250,23 @@ def main(args: argparse.Namespace) -> None:
         items = visitor.graph.items()
     outlinked: Set[str] = set()
     mentioned: Set[str] = set()
+    skipped = frozenset(args.skip) | (terminals if args.no_terminals else frozenset())
+    include_invalid = args.include_invalid
+
+    def keep(name: str) -> bool:
+        return name not in skipped and (include_invalid or not name.startswith("invalid_"))
+
     for name, edges in items:
-        if name in args.skip:
+        if not keep(name):
             continue
-        edges = (name for name in edges if name not in args.skip)
-        if not args.include_invalid:
-            if name.startswith("invalid_"):
-                continue
-            edges = (name for name in edges if not name.startswith("invalid_"))
-        if args.no_terminals:
-            if name in terminals:
-                continue
-            edges = (name for name in edges if name not in terminals)
-        if args.canonical == "name_sort":
-            edges = sorted(edges)
-        s = ','.join(edges)
+        kept = [edge for edge in edges if keep(edge)]  # Already sorted for name_sort
+        s = ','.join(kept)
         if not s:
             continue # "name -> ;" is syntax error; s is empty means all edges are filtered out
         outlinked.add(name)
         mentioned.add(name)
-        mentioned.update(s.split(","))
-        print(f"    {name} -> {s};")
+        mentioned.update(kept)
+        out.append(f"    {name} -> {s};")
 
     # Note: printing nodes before edges affects rendered layout
     # Precedence: args.highlight > mentioned - outlinked
@@ -243,9 +281,9 @@ def main(args: argparse.Namespace) -> None:
             # Note: `color` is picked deeper and `fillcolor` lighter to make it more colorblind-friendly
             # (even when higher_contrast_highlight is off -- people can forget)
             if name == root_node:
-                print(f'    {name} [color="{color}", fontcolor=black, fillcolor="{fillcolor}", penwidth="{penwidth}"]')
+                out.append(f'    {name} [color="{color}", fontcolor=black, fillcolor="{fillcolor}", penwidth="{penwidth}"]')
             else:
-                print(f'    {name} [color="{color}", fillcolor="{fillcolor}", penwidth="{penwidth}"]')
+                out.append(f'    {name} [color="{color}", fillcolor="{fillcolor}", penwidth="{penwidth}"]')
             final.add(name)
         else:
             print(f"{name} is not highlighted because it is not present in the result graph",
@@ -254,10 +292,11 @@ def main(args: argparse.Namespace) -> None:
     if not args.dont_fade_no_outgoing_rules:
         for name in mentioned - outlinked:
             if name not in final:
-                print(f'    {name} [fontcolor="#777", fillcolor="#fafafa"]')
+                out.append(f'    {name} [fontcolor="#777", fillcolor="#fafafa"]')
                 #final.add(name)
 
-    print("}")
+    out.append("}")
+    sys.stdout.write("\n".join(out) + "\n")
 
 
 if __name__ == "__main__":
@@ -61,20 +61,24 @@ Expected output:
 """
 
 import argparse
-from enum import Enum, IntEnum
+from array import array
+from enum import IntEnum
+import functools
 import sys
-from typing import TYPE_CHECKING, Any, Callable, Iterable, Iterator, List, NamedTuple, Set, Dict, Tuple, Union, cast
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Iterator, List, NamedTuple, Set, Dict, Tuple, Type
 from dataclasses import dataclass
-from collections import deque
 from contextlib import contextmanager
 import operator
 from ast import literal_eval
 
-from stde.pegen.v2.parser import FAILURE
+from stde.pegen.v2.parser import FAILURE, BaseParser
 
 #from stde.pegen import build, build_v2, grammar as grammar_mod, grammar_v2
-from stde.pegen.legacy import build, grammar as grammar_mod
+# stde.pegen itself already imports the v2 modules, but the legacy ones are
+# only needed by main() for non-v2 grammars (and for type checking)
 from stde.pegen.v2 import build as build_v2, grammar as grammar_v2
+if TYPE_CHECKING:
+    from stde.pegen.legacy import build, grammar as grammar_mod
 
 sys.path.insert(0, ".")
 
@@ -104,32 +108,46 @@ TERMINALS_V1 = {"SOFT_KEYWORD", "NAME", "NUMBER", "STRING",
                 "FSTRING_START", "FSTRING_MIDDLE", "FSTRING_END", "OP", "TYPE_COMMENT",
                 "NEWLINE", "DEDENT", "INDENT", "ENDMARKER", "ASYNC", "AWAIT"}
 
-parser_class = build_v2.generate_parser_from_grammar("""
-@base CharBasedParser
+QUERY_GRAMMAR = """
+@base QueryParserBase
 @header '''
 from ast import literal_eval
+from string import ascii_letters, digits
 def process_string(s):
     return literal_eval(s)
+
+class QueryParserBase(CharBasedParser):
+    # Single character classes, instead of an alternative for each character
+    def _char_in(self, chars):
+        # Peek before consuming, so that a mismatch doesn't advance the farthest position
+        if self._pos < len(self._text) and self._text[self._pos] in chars:
+            return self.any_char()
+        return FAILURE
+
+    def letter(self):
+        return self._char_in(ascii_letters)
+
+    def number(self):
+        return self._char_in(digits)
 '''
 start: item ":" strict? op limit $
 item: string { (True, string) } | name { (False, name) }
 name: a=letter+ { "".join(a) }
-letter: "a" | "b" | "c" | "d" | "e" | "f" | "g" | "h"
-      | "i" | "j" | "k" | "l" | "m" | "n" | "o" | "p"
-      | "q" | "r" | "s" | "t" | "u" | "v" | "w" | "x"
-      | "y" | "z" | "A" | "B" | "C" | "D" | "E" | "F"
-      | "G" | "H" | "I" | "J" | "K" | "L" | "M" | "N"
-      | "O" | "P" | "Q" | "R" | "S" | "T" | "U" | "V"
-      | "W" | "X" | "Y" | "Z"
 string: '"' a=(!'"' any_char)* '"' { process_string('"' + "".join(a) + '"') }
       | "'" a=(!"'" any_char)* "'" { process_string("'" + "".join(a) + "'") }
 op: "<=" | ">=" | "<" | "==" | ">"
 strict: "strict"
 limit: integer | "*"
 integer: a=number+ { int("".join(a)) }
-number: "0" | "1" | "2" | "3" | "4" | "5" | "6" | "7" | "8" | "9"
 extern any_char
-""").parser_class
+extern letter
+extern number
+"""
+
+@functools.lru_cache(None)
+def get_query_parser_class() -> Type[BaseParser]:
+    """Generate the parser of the query language on first use."""
+    return build_v2.generate_parser_from_grammar(QUERY_GRAMMAR).parser_class
 
 class ItemType(IntEnum):
     NAME = 0
@@ -139,20 +157,14 @@ class ItemType(IntEnum):
         #return f"{self.__class__.__name__}.{self._name_}"
         return self._name_
 
-class Compare(Enum):
-    # cast is necessary or Pylance treats as functions(methods?)
-    LT = cast(Callable[..., bool], operator.lt)
-    EQ = cast(Callable[..., bool], operator.eq)
-    GT = cast(Callable[..., bool], operator.gt)
-    LE = cast(Callable[..., bool], operator.le)
-    GE = cast(Callable[..., bool], operator.ge)
-
-compare_table = {
-    "<": Compare.LT,
-    "==": Compare.EQ,
-    ">": Compare.GT,
-    "<=": Compare.LE,
-    ">=": Compare.GE,
+Compare = Callable[[float, float], bool]
+
+compare_table: Dict[str, Compare] = {
+    "<": operator.lt,
+    "==": operator.eq,
+    ">": operator.gt,
+    "<=": operator.le,
+    ">=": operator.ge,
 }
 
 class Item(NamedTuple):
@@ -169,16 +181,21 @@ class Query(NamedTuple):
     item: Item
     strict: bool
     op: Compare
-    limit: int
+    limit: float # May be infinity
 
 def _parse_query(s: str) -> Query:
-    parser = parser_class.from_text(s)
+    parser = get_query_parser_class().from_text(s)
     res = parser.start()
     if res is FAILURE:
         raise parser.make_syntax_error(f"Cannot parse query {s}.")
     #print(res)
     item = Item(ItemType.STRING if res[0][0] else ItemType.NAME, res[0][1]) #type:ignore[index]
-    return Query(item, bool(res[2]), compare_table[res[3]], res[4]) #type:ignore
+    limit = float("inf") if res[4] == "*" else res[4] #type:ignore[index]
+    return Query(item, bool(res[2]), compare_table[res[3]], limit) #type:ignore
+
+
+# The same string literal is usually used many times in a grammar
+_string_value = functools.lru_cache(None)(literal_eval)
 
 
 class Visitor(GrammarVisitor):
@@ -202,11 +219,12 @@ class Visitor(GrammarVisitor):
         self.current_rule_name = ""
 
     def add_item(self, item: Item) -> None:
-        if item not in self.dedupe_graph:
-            self.dedupe_graph[item] = set()
+        users = self.dedupe_graph.get(item)
+        if users is None:
+            users = self.dedupe_graph[item] = set()
             self.graph[item] = []
-        if self.current_rule_name not in self.dedupe_graph[item]:
-            self.dedupe_graph[item].add(self.current_rule_name)
+        if self.current_rule_name not in users:
+            users.add(self.current_rule_name)
             self.graph[item].append(self.current_rule_name)
 
     def visit_PositiveLookahead(self, lkh: PositiveLookahead) -> None:
@@ -223,11 +241,11 @@ class Visitor(GrammarVisitor):
         with self.in_rule(rule.name):
             self.visit(rule.rhs)
 
-    def visit_NameLeaf(self, leaf: Union[grammar_mod.NameLeaf, grammar_v2.NameLeaf]) -> None:
+    def visit_NameLeaf(self, leaf: "grammar_mod.NameLeaf | grammar_v2.NameLeaf") -> None:
         self.add_item(Item(ItemType.NAME, leaf.value))
 
-    def visit_StringLeaf(self, leaf: Union[grammar_mod.StringLeaf, grammar_v2.StringLeaf]) -> None:
-        self.add_item(Item(ItemType.STRING, literal_eval(leaf.value)))
+    def visit_StringLeaf(self, leaf: "grammar_mod.StringLeaf | grammar_v2.StringLeaf") -> None:
+        self.add_item(Item(ItemType.STRING, _string_value(leaf.value)))
 
 
 def make_used_by_graph(grammar: "build.Grammar | build_v2.Grammar", args: argparse.Namespace
@@ -237,37 +255,112 @@ def make_used_by_graph(grammar: "build.Grammar | build_v2.Grammar", args: argpar
     return visitor.graph
 
 
-class Node(NamedTuple):
-    item: Item
-    distance: int
-
-
-def process_query(query: Query, graph: Dict[Item, List[str]]) -> List[str]:
+def max_distance_for(query: Query) -> float:
+    """Distance beyond which a rule can't be accepted by query."""
+    return (query.limit - 1 if query.op is operator.lt
+            else query.limit if query.op is operator.eq
+            else float("inf"))
+
+
+class CompactGraph(NamedTuple):
+    """Used-by graph in compressed sparse row form: items are numbered,
+    and the ids of rules using item i are indices[indptr[i]:indptr[i+1]]."""
+    ids: Dict[Item, int]
+    names: List[str] # id -> item.string
+    indptr: "array[int]"
+    indices: "array[int]"
+
+
+def compact_graph(graph: Dict[Item, List[str]]) -> CompactGraph:
+    ids: Dict[Item, int] = {}
+    for item, users in graph.items():
+        ids.setdefault(item, len(ids))
+        for name in users:
+            ids.setdefault(Item(ItemType.NAME, name), len(ids))
+    indptr = array("i", [0])
+    indices = array("i")
+    for item in ids: # In id order
+        indices.extend(ids[Item(ItemType.NAME, name)] for name in graph.get(item, ()))
+        indptr.append(len(indices))
+    return CompactGraph(ids, [item.string for item in ids], indptr, indices)
+
+
+def distances_from(item: Item, graph: CompactGraph, max_distance: float) -> Dict[str, int]:
+    """Find rules that (directly or indirectly) use item within max_distance recursions,
+    mapped to their minimal distance (in BFS order)."""
+    dist: Dict[str, int] = {}
+    start = graph.ids.get(item)
+    if start is None:
+        return dist
+    names, indptr, indices = graph.names, graph.indptr, graph.indices
+    visited = bytearray(len(names))
+    visited[start] = 1
+    # Level-synchronous BFS: frontier holds the ids at `distance`
+    frontier = [start]
+    distance = 0
+    while frontier and distance < max_distance:
+        distance += 1
+        next_frontier: List[int] = []
+        for x in frontier:
+            for y in indices[indptr[x]:indptr[x + 1]]:
+                if not visited[y]:
+                    visited[y] = 1
+                    dist[names[y]] = distance
+                    next_frontier.append(y)
+        frontier = next_frontier
+    return dist
+
+
+def reverse_graph(graph: CompactGraph) -> CompactGraph:
+    """Transpose graph, giving the "uses" graph (ids of items used by rule i)."""
+    n = len(graph.names)
+    users_of = [graph.indices[graph.indptr[i]:graph.indptr[i + 1]] for i in range(n)]
+    uses: List[List[int]] = [[] for _ in range(n)]
+    for item_id, users in enumerate(users_of):
+        for user_id in users:
+            uses[user_id].append(item_id)
+    indptr = array("i", [0])
+    indices = array("i")
+    for used in uses:
+        indices.extend(used)
+        indptr.append(len(indices))
+    return CompactGraph(graph.ids, graph.names, indptr, indices)
+
+
+def used_by_root(root: str, graph: CompactGraph) -> Set[str]:
+    """Find root and the rules it (directly or indirectly) uses.
+
+    Combined with the results of distances_from (which search backwards from an item)
+    this narrows results down to rules on some path from root to the item."""
+    start = graph.ids.get(Item(ItemType.NAME, root))
+    if start is None:
+        raise ValueError(f"Unknown root {root!r}")
+    uses = reverse_graph(graph)
+    visited = bytearray(len(graph.names))
+    visited[start] = 1
+    frontier = [start]
+    while frontier:
+        next_frontier: List[int] = []
+        for x in frontier:
+            for y in uses.indices[uses.indptr[x]:uses.indptr[x + 1]]:
+                if not visited[y]:
+                    visited[y] = 1
+                    next_frontier.append(y)
+        frontier = next_frontier
+    return {name for name, seen in zip(graph.names, visited) if seen}
+
+
+def build_reachability(graph: CompactGraph, items: Iterable[Item],
+                       max_distance: float) -> Dict[Item, Dict[str, int]]:
+    """Run distances_from once for each distinct item, so queries on the same item share it."""
+    return {item: distances_from(item, graph, max_distance) for item in set(items)}
+
+
+def process_query(query: Query, reachability: Dict[Item, Dict[str, int]]) -> List[str]:
     if query.strict:
         raise NotImplementedError("strict feature in progress")
-    max_distance = (query.limit - 1 if query.op == Compare.LT
-                    else query.limit if query.op == Compare.EQ
-                    else float("inf"))
-    q: deque[Node] = deque([Node(query.item, 0)])
-    visited: Set[str] = set()
-    res: List[str] = []
-    while q:
-        x, distance = q.popleft()
-        if x.type == ItemType.NAME and x.string in visited: continue
-        visited.add(x.string)
-
-        if x in graph:
-            for y in graph[x]:
-                if y not in visited:
-                    new_distance = distance + 1
-                    if new_distance > max_distance:
-                        continue # Prune
-                    # Note: Always a name since strings cannot use other rules
-                    q.append(Node(Item(ItemType.NAME, y), new_distance))
-                    if query.op._value_(new_distance, query.limit):
-                        res.append(y)
-
-    return res
+    op, limit = query.op, query.limit
+    return [name for name, distance in reachability[query.item].items() if op(distance, limit)]
 
 
 def main(args: argparse.Namespace) -> None:
@@ -283,12 +376,27 @@ def main(args: argparse.Namespace) -> None:
         print("ERROR: Failed to parse grammar file", file=sys.stderr)
         sys.exit(1)
 
-    graph = make_used_by_graph(grammar, args)
+    graph = compact_graph(make_used_by_graph(grammar, args))
     #print(graph)
-
+    reachability = build_reachability(
+        graph, (query.item for query in args.queries),
+        max((max_distance_for(query) for query in args.queries), default=0))
+
+    if args.from_root is not None:
+        try:
+            scope = used_by_root(args.from_root, graph)
+        except ValueError as err:
+            print(f"ERROR: {err}", file=sys.stderr)
+            sys.exit(1)
+
+    out = []
     for query in args.queries:
-        res = process_query(query, graph)
-        print(",".join(res) or "(none)")
+        res = process_query(query, reachability)
+        if args.from_root is not None:
+            res = [name for name in res if name in scope]
+        out.append(",".join(res) or "(none)")
+    if out:
+        sys.stdout.write("\n".join(out) + "\n")
 
 
 if __name__ == "__main__":
@@ -303,6 +411,9 @@ if __name__ == "__main__":
                    help="Queries.")
     p.add_argument("-v2", action="store_true",
                    help="Parse grammar as v2.")
+    p.add_argument("--from-root", metavar="NAME",
+                   help="Only show rules that NAME (directly or indirectly) uses, "
+                        "or NAME itself.")
     p.add_argument("--positive-lookahead-as-usage", "--lkh-as-usage", action="store_false",
                    help="Treat positive lookahead (&x) as usage.")
     p.add_argument("--negative-lookahead-as-usage", "--neglkh-as-usage", action="store_true",
@@ -1,14 +1,17 @@
 #!/usr/bin/env python3.8
 
 import argparse
+import io
 import os
-import glob
 import tarfile
+import tempfile
 import zipfile
 import shutil
 import sys
+from contextlib import redirect_stderr, redirect_stdout
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
-from typing import Generator, Any, TYPE_CHECKING
+from typing import Dict, Generator, Any, Optional, Tuple
 
 sys.path.insert(0, ".")
 from stde.pegen.legacy import build
@@ -24,27 +27,51 @@ argparser.add_argument(
 
 
 def get_packages() -> Generator[str, None, None]:
-    yield from glob.iglob("./data/pypi/*.tar.gz")
-    yield from glob.iglob("./data/pypi/*.zip")
-    yield from glob.iglob("./data/pypi/*.tgz")
-
-
-def extract_files(filename: str) -> None:
-    savedir = os.path.join("data", "pypi")
-    if tarfile.is_tarfile(filename):
-        tarfile.open(filename).extractall(savedir)
-    elif zipfile.is_zipfile(filename):
-        zipfile.ZipFile(filename).extractall(savedir)
-    else:
-        raise ValueError(f"Could not identify type of compressed file {filename}")
-
-
-def find_dirname(package_name: str) -> str:
-    for name in os.listdir(os.path.join("data", "pypi")):
-        full_path = os.path.join("data", "pypi", name)
-        if os.path.isdir(full_path) and name in package_name:
-            return full_path
-    if TYPE_CHECKING: assert False
+    # One directory pass instead of one glob per extension
+    with os.scandir("./data/pypi") as it:
+        for entry in it:
+            if entry.name.endswith((".tar.gz", ".zip", ".tgz")) and entry.is_file():
+                yield entry.path
+
+
+def extract_files(filename: str, savedir: str) -> None:
+    # Open the file once as a stream instead of checking is_tarfile first
+    try:
+        with tarfile.open(filename, "r|*") as tf:
+            tf.extractall(savedir, filter="data")
+        return
+    except tarfile.ReadError:
+        pass  # Not a tar file, try zip
+    except tarfile.TarError as e:
+        # e.g. FilterError for links or absolute paths rejected by the "data" filter
+        raise ValueError(f"Could not extract {filename}: {e}") from None
+    try:
+        with zipfile.ZipFile(filename) as zf:
+            zf.extractall(savedir)
+    except zipfile.BadZipFile:
+        raise ValueError(f"Could not identify type of compressed file {filename}") from None
+
+
+def find_dirname(package_name: str, savedir: str) -> Optional[str]:
+    # savedir only holds this package's extraction (see extract_package),
+    # so this scans a single entry rather than every extracted package
+    with os.scandir(savedir) as it:
+        for entry in it:
+            if entry.name in package_name and entry.is_dir():
+                return entry.path
+    return None
+
+
+def extract_package(package: str) -> Tuple[str, Optional[str]]:
+    """Extract package into its own directory under data/pypi, so that packages can be
+    extracted concurrently. Return that directory and the package directory found in it."""
+    savedir = tempfile.mkdtemp(prefix="extract_", dir=os.path.join("data", "pypi"))
+    try:
+        extract_files(package, savedir)
+    except BaseException:
+        shutil.rmtree(savedir)
+        raise
+    return savedir, find_dirname(package, savedir)
 
 
 def run_tests(dirname: str, tree: int) -> int:
@@ -68,27 +95,48 @@ def run_tests(dirname: str, tree: int) -> int:
     )
 
 
+def run_tests_captured(dirname: str, tree: int) -> Tuple[int, str]:
+    """run_tests, returning its output too, so that the output of packages
+    parsed concurrently can be printed one package at a time."""
+    output = io.StringIO()
+    with redirect_stdout(output), redirect_stderr(output):
+        status = run_tests(dirname, tree)
+    return status, output.getvalue()
+
+
 def main() -> None:
     args = argparser.parse_args()
     tree = args.tree
 
-    for package in get_packages():
-        print(f"Extracting files from {package}... ", end="")
-        try:
-            extract_files(package)
-            print("Done")
-        except ValueError as e:
-            print(e)
-            continue
-
-        print(f"Trying to parse all python files ... ")
-        dirname = find_dirname(package)
-        status = run_tests(dirname, tree)
-        if status == 0:
-            print("Done")
-            shutil.rmtree(dirname)
-        else:
-            print(f"Failed to parse {dirname}")
+    # Extraction is I/O-bound and parsing is CPU-bound: extract in threads,
+    # and parse each package in a worker process as soon as it is extracted
+    with ThreadPoolExecutor(max_workers=4) as extractors, ProcessPoolExecutor() as parsers:
+        extractions = {extractors.submit(extract_package, package): package
+                       for package in get_packages()}
+        parses: Dict[Future[Tuple[int, str]], Tuple[str, str]] = {}
+        for extraction in as_completed(extractions):
+            package = extractions[extraction]
+            try:
+                savedir, dirname = extraction.result()
+            except ValueError as e:
+                print(e)
+                continue
+            if dirname is None:
+                print(f"Could not find the package directory extracted from {package}, skipping")
+                shutil.rmtree(savedir)
+                continue
+            print(f"Extracted files from {package}, trying to parse all python files ...")
+            parses[parsers.submit(run_tests_captured, dirname, tree)] = savedir, dirname
+
+        for parse in as_completed(parses):
+            savedir, dirname = parses[parse]
+            status, output = parse.result()
+            print(output, end="")
+            if status == 0:
+                print(f"Done: {dirname}")
+                shutil.rmtree(savedir)
+            else:
+                print(f"Failed to parse {dirname}")
 
 
 if __name__ == "__main__":
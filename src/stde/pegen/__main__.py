@@ -10,46 +10,80 @@ Search the web for PEG Parsers for reference.
 """
 
 import argparse
+import os
 import sys
 import time
 import token
-import traceback
-from typing import Any
-from stde.pegen.legacy.build import generate_code_from_file, CodeFromFileProducts
-from stde.pegen.v2.build import (generate_code_from_file as generate_code_from_file_v2,
-                                 CodeFromFileProducts as CodeFromFileProductsV2)
-from stde.pegen.legacy.validator import validate_grammar
+from typing import Any, Callable, Tuple, TypeVar
+from stde.pegen.v2.build import generate_code_from_file as generate_code_from_file_v2
 from stde.pegen.v2.validator import validate_grammar as validate_grammar_v2
+# The legacy modules are only imported in legacy mode
 
+P = TypeVar("P")
 
-def generate_python_code(
-    args: argparse.Namespace,
-) -> CodeFromFileProducts:
-    try:
-        return generate_code_from_file(
-            args.grammar_file,
-            args.output,
-            sys.stdout if args.verbose_tokenization else None,
-            sys.stdout if args.verbose_parsing else None,
-            skip_actions=args.skip_actions,
-        )
-    except Exception as err:
-        traceback.print_exception(err.__class__, err, None)
-        raise  # Show traceback
-
-
-def generate_python_code_v2(args: argparse.Namespace) -> CodeFromFileProductsV2:
-    try:
-        return generate_code_from_file_v2(
-            args.grammar_file,
-            args.output,
-            sys.stdout if args.verbose_tokenization else None,
-            sys.stdout if args.verbose_parsing else None,
-            skip_actions=args.skip_actions,
-        )
-    except Exception as err:
-        traceback.print_exception(err.__class__, err, None)
-        raise  # Show traceback
+
+def generate_python_code(args: argparse.Namespace,
+                         generate_code_from_file: Callable[..., P]) -> P:
+    """Call generate_code_from_file (of legacy or v2 build) with arguments from args."""
+    return generate_code_from_file(
+        args.grammar_file,
+        args.output,
+        sys.stdout if args.verbose_tokenization else None,
+        sys.stdout if args.verbose_parsing else None,
+        skip_actions=args.skip_actions,
+    )
+
+
+def print_indented(text: str) -> None:
+    # One writelines call rather than a print call per line
+    sys.stdout.writelines(f"  {line}\n" for line in text.splitlines())
+
+
+def short_excepthook(exc_type: Any, exc: BaseException, tb: Any) -> None:
+    """sys.excepthook for non-verbose runs: show just the error, not the traceback."""
+    if not issubclass(exc_type, Exception):  # e.g. KeyboardInterrupt
+        sys.__excepthook__(exc_type, exc, tb)
+        return
+    sys.stderr.write(f"{exc_type.__name__}: {exc}\nFor full traceback, use -v\n")
+
+
+def get_backend(mode: str) -> Tuple[Callable[..., Any], Callable[[Any], None]]:
+    """Return generate_code_from_file and validate_grammar of mode ("v2" or "legacy")."""
+    if mode == "v2":
+        return generate_code_from_file_v2, validate_grammar_v2
+    elif mode == "legacy":
+        from stde.pegen.legacy.build import generate_code_from_file
+        from stde.pegen.legacy.validator import validate_grammar
+        return generate_code_from_file, validate_grammar
+    else:
+        assert False, mode
+
+
+def build_one(mode: str, grammar_path: str, skip_actions: bool, validate: bool) -> None:
+    """Generate the parser of a --batch grammar file next to it (foo.gram -> foo.py)."""
+    generate_code_from_file, validate_grammar = get_backend(mode)
+    output = os.path.splitext(grammar_path)[0] + ".py"
+    products = generate_code_from_file(grammar_path, output, skip_actions=skip_actions)
+    if validate:
+        validate_grammar(products.grammar)
+
+
+def build_batch(args: argparse.Namespace) -> int:
+    """Build the grammar files listed in args.batch in worker processes.
+    Returns the number of failed builds."""
+    paths = [line.strip() for line in args.batch if line.strip()]
+    from concurrent.futures import ProcessPoolExecutor
+    failed = 0
+    with ProcessPoolExecutor() as executor:
+        futures = [executor.submit(build_one, args.mode, path, args.skip_actions, not args.no_validate)
+                   for path in paths]
+        for path, future in zip(paths, futures):
+            try:
+                future.result()
+            except Exception as err:
+                print(f"{path}: {err.__class__.__name__}: {err}", file=sys.stderr)
+                failed += 1
+    return failed
 
 
 p = argparse.ArgumentParser(
@@ -68,40 +102,45 @@ p.add_argument("--verbose-tokenization", action="store_true",
                help="Show debug output of tokenization of grammar source")
 p.add_argument("--verbose-parsing", action="store_true",
                help="Show debug output of parsing of grammar source")
-p.add_argument("grammar_file", type=argparse.FileType("r"),
+p.add_argument("grammar_file", type=argparse.FileType("r"), nargs="?",
                help="Grammar description")
+p.add_argument("--batch", metavar="LIST", type=argparse.FileType("r"),
+               help="Instead of grammar_file, build every grammar file listed in LIST "
+                    "(one path per line) in parallel, writing foo.py next to each foo.gram")
 p.add_argument("-o", "--output", metavar="OUT", default="parse.py",
                help="Where to write the generated parser")
 p.add_argument("--skip-actions", action="store_true",
                help="Suppress code emission for rule actions")
+p.add_argument("--no-validate", action="store_true",
+               help="Skip validating the grammar after generating the parser")
 
 
 def main() -> None:
     args = p.parse_args()
+    if not args.verbose:
+        sys.excepthook = short_excepthook
+    if args.batch is not None:
+        if build_batch(args):
+            sys.exit(1)
+        return
+    if args.grammar_file is None:
+        p.error("the following arguments are required: grammar_file (or --batch)")
 
     products: Any
-    if args.mode == "v2":
-        t0 = time.time()
-        products = generate_python_code_v2(args)
-        t1 = time.time()
+    generate_code_from_file, validate_grammar = get_backend(args.mode)
+    t0 = time.perf_counter_ns()
+    products = generate_python_code(args, generate_code_from_file)
+    t1 = time.perf_counter_ns()
+    if not args.no_validate:
         validate_grammar(products.grammar)
-    elif args.mode == "legacy":
-        t0 = time.time()
-        products = generate_python_code(args)
-        t1 = time.time()
-        validate_grammar_v2(products.grammar)
-    else:
-        assert False, args.mode
 
     if args.verbose > 1:
         print("Raw Grammar:")
-        for line in repr(products.grammar).splitlines():
-            print(" ", line)
+        print_indented(repr(products.grammar))
 
     if args.verbose:
         print("Clean Grammar:")
-        for line in str(products.grammar).splitlines():
-            print(" ", line)
+        print_indented(str(products.grammar))
 
     if args.verbose > 1:
         print("First Graph:")
@@ -122,7 +161,10 @@ def main() -> None:
                 else:
                     print()
 
-        dt = t1 - t0
+        dt = (t1 - t0) / 1e9
+        if products.grammar_tokenizer is None:  # Grammar loaded from cache
+            print(f"Total time: {dt:.3f} sec (grammar loaded from cache)")
+            return
         diag = products.grammar_tokenizer.diagnose()
         nlines = diag.end[0]
         if diag.type == token.ENDMARKER:
@@ -132,9 +174,14 @@ def main() -> None:
             print(f"; {nlines / dt:.0f} lines/sec")
         else:
             print()
+        cache = products.grammar_parser._cache
+        if args.mode == "v2":  # One memo cache per rule
+            cache_size = sum(map(len, cache.values()))
+        else:
+            cache_size = len(cache)
         print("Caches sizes:")
         print(f"  token array : {len(products.grammar_tokenizer._tokens):10}")
-        print(f"        cache : {len(products.grammar_parser._cache):10}")
+        print(f"        cache : {cache_size:10}")
 
 
 if __name__ == "__main__":
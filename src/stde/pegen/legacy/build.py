@@ -33,9 +33,10 @@ use the new equivalents because the legacy functions are not tested anymore:
 #TODO: Organize comments & docs
 
 from enum import Enum
-from functools import partial
+from functools import lru_cache, partial
 import sys
 import tokenize, io
+from types import CodeType
 from typing import TYPE_CHECKING, Any, Literal, NamedTuple, Optional, TextIO, Tuple, Type, Union, Protocol, cast
 
 from stde.pegen.common import DEFAULT_PARSER_CLASS_NAME
@@ -205,7 +206,7 @@ def generate_code_from_file(
 ) -> CodeFromFileProducts:
     grammar_file_name = _grammar_file_name_fallback(grammar_file_name, grammar_file)
     p = load_grammar_from_file(grammar_file, tokenizer_verbose_stream, parser_verbose_stream,
-                               edition=edition)
+                               edition=edition, grammar_file_name=grammar_file_name)
     p2 = generate_code_from_grammar(p.grammar, grammar_file_name, output_file,
                                     edition=edition, skip_actions=skip_actions)
     return CodeFromFileProducts(p.grammar, p.grammar_parser, p.grammar_tokenizer,
@@ -215,6 +216,11 @@ def generate_code_from_file(
 class ParserFromCodeProducts(NamedTuple):
     parser_class: Type[Parser]
 
+@lru_cache(maxsize=16)
+def _compile_parser_code(parser_code: str) -> CodeType:
+    # Same as in v2 build: reuse the compiled code when the same parser code is executed again
+    return compile(parser_code, "<string>", "exec")
+
 def generate_parser_from_code(parser_code: str, parser_class_name: str = "GeneratedParser",
                               edition: Edition = "1"
                               ) -> ParserFromCodeProducts:
@@ -222,7 +228,7 @@ def generate_parser_from_code(parser_code: str, parser_class_name: str = "Genera
     so do not pass it parser code from untrusted sources."""
     if edition == "1":
         ns: Any = {}
-        exec(parser_code, ns)
+        exec(_compile_parser_code(parser_code), ns)
         return ParserFromCodeProducts(ns[parser_class_name])
     raise NotImplementedError('Editions other than "1" are not supported yet')
 
@@ -288,6 +294,8 @@ def generate_parser_from_file(
     *,
     grammar_file_name: Optional[str] = None
 ) -> ParserFromFileProducts:
+    # Resolve the name once, for both loading and the generated parser's header
+    grammar_file_name = _grammar_file_name_fallback(grammar_file_name, grammar_file)
     # Grammar file → Grammar
     p = load_grammar_from_file(
         grammar_file, tokenizer_verbose_stream, parser_verbose_stream, grammar_file_name=grammar_file_name)
@@ -1,7 +1,5 @@
-import io
 import token
 import tokenize
-from weakref import finalize
 from tokenize import TokenInfo
 from typing import Any, Dict, Iterator, List, Optional, Self, TextIO
 from abc import abstractmethod
@@ -93,10 +91,12 @@ class Tokenizer(AbstractTokenizer):
 
     @classmethod
     def from_text(cls, text: str, *, path: str = "", verbose_stream: Optional[TextIO] = None) -> Self:
-        stream = io.StringIO(text)
-        instance = cls(tokenize.generate_tokens(stream.readline), path=path, verbose_stream=verbose_stream)
-        finalize(instance, lambda: stream.close() if not stream.closed else None) #XXX: Should be ok?
-        return instance
+        # Feed lines straight from the string instead of through an io.StringIO.
+        # Split on "\n" only (like StringIO.readline), not on every splitlines() boundary.
+        lines = text.split("\n")
+        for i in range(len(lines) - 1):
+            lines[i] += "\n"
+        return cls(tokenize.generate_tokens(iter(lines).__next__), path=path, verbose_stream=verbose_stream)
 
     @classmethod
     def from_tokens(cls, tokens: Iterator[TokenInfo], *, path: str = "", verbose_stream: Optional[TextIO] = None) -> Self:
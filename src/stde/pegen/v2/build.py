@@ -23,6 +23,12 @@ Note that generate_code_from_grammar does not accept grammar string,
 you need to use load_grammar_from_string for grammar strings first.
 However, generate_parser_from_grammar accepts grammar string.
 
+## Disk cache
+When the environment variable STDE_PEGEN_CACHE is set to 1 (see DISK_CACHE_ENV),
+load_grammar_from_file caches parsed grammars and generate_parser_from_code caches
+compiled parser code in $XDG_CACHE_HOME/stde.pegen (or ~/.cache/stde.pegen when
+XDG_CACHE_HOME isn't set). The cache files can be deleted at any time.
+
 ## Migration from early versions
 The old functions are still there but new code is encouraged to
 use the new equivalents because the legacy functions are not tested anymore:
@@ -33,11 +39,20 @@ use the new equivalents because the legacy functions are not tested anymore:
 
 #TODO: Organize comments & docs
 
+from __future__ import annotations
+
 from enum import Enum
-from functools import partial
+from functools import lru_cache, partial
+import hashlib
+import importlib.util
+import marshal
+import os
+import pickle
 import sys
 import tokenize, io
-from typing import TYPE_CHECKING, Any, Literal, NamedTuple, Optional, TextIO, Tuple, Type, Union, Protocol, cast
+from types import CodeType
+from typing import (TYPE_CHECKING, Any, Dict, List, Literal, NamedTuple, Optional, Sequence, TextIO, Tuple, Type,
+                    Union, Protocol, cast)
 
 from stde.pegen.common import DEFAULT_PARSER_CLASS_NAME
 from stde.pegen.v2.grammar import Grammar
@@ -55,6 +70,7 @@ __all__ = ["Grammar", "BaseParser", "Tokenizer", "GrammarParser", "ParserGenerat
            "load_grammar_from_string", "load_grammar_from_file",
            "generate_code_from_grammar", "generate_code_from_file",
            "generate_parser_from_grammar", "generate_parser_from_file",
+           "generate_parsers_from_files",
            ]
 
 #reveal_type(FAILURE)
@@ -107,10 +123,54 @@ grammar --> code
 code --> parser
 """
 
+DISK_CACHE_ENV = "STDE_PEGEN_CACHE"
+"""When this environment variable is set to 1, load_grammar_from_file caches
+parsed grammars (pickled) and generate_parser_from_code caches compiled parser code
+(marshalled) in $XDG_CACHE_HOME/stde.pegen, or ~/.cache/stde.pegen."""
+
+
+def _cache_dir() -> str:
+    return os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "stde.pegen")
+
+
+def _write_cache_file(path: str, data: bytes) -> None:
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename, so a concurrent run never sees a partial file
+        with open(f"{path}.{os.getpid()}.tmp", "wb") as f:
+            f.write(data)
+        os.replace(f"{path}.{os.getpid()}.tmp", path)
+    except OSError:
+        pass # Caching is best-effort
+
+
+def _grammar_cache_path(grammar_file: File) -> Optional[str]:
+    """Path of the cached Grammar of grammar_file,
+    or None if caching is disabled or grammar_file is not a file path."""
+    if os.environ.get(DISK_CACHE_ENV) != "1":
+        return None
+    if not isinstance(grammar_file, (str, bytes)) and not hasattr(grammar_file, "__fspath__"):
+        return None
+    path = os.path.abspath(os.fsdecode(grammar_file)) #type:ignore[arg-type]
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    # Also key on the grammar parser and Grammar classes, so that their changes invalidate the cache
+    key = hashlib.blake2b(
+        f"{path}\0{st.st_mtime_ns}\0{st.st_size}\0"
+        f"{os.stat(sys.modules[GrammarParser.__module__].__file__).st_mtime_ns}\0" #type:ignore[arg-type]
+        f"{os.stat(sys.modules[Grammar.__module__].__file__).st_mtime_ns}".encode(), #type:ignore[arg-type]
+        digest_size=16).hexdigest()
+    return os.path.join(_cache_dir(), f"grammar_{key}.pickle")
+
+
 class GrammarFromFileProducts(NamedTuple):
+    """grammar_parser and grammar_tokenizer are None
+    when the grammar is loaded from the disk cache (see DISK_CACHE_ENV)."""
     grammar: Grammar
-    grammar_parser: BaseParser
-    grammar_tokenizer: Tokenizer
+    grammar_parser: Optional[BaseParser]
+    grammar_tokenizer: Optional[Tokenizer]
 
 def load_grammar_from_file(
     grammar_file: File,
@@ -119,8 +179,19 @@ def load_grammar_from_file(
     *,
     grammar_file_name: Optional[str] = None,
 ) -> GrammarFromFileProducts:
-    """Returns BuiltProducts with fields grammar, parser and tokenizer filled."""
+    """Returns GrammarFromFileProducts with fields grammar, grammar_parser and grammar_tokenizer
+    filled, except that grammar_parser and grammar_tokenizer are None on a disk cache hit."""
     grammar_file_name = _grammar_file_name_fallback(grammar_file_name, grammar_file)
+    # Verbose output is only produced by actually parsing
+    cache_path = (_grammar_cache_path(grammar_file)
+                  if tokenizer_verbose_stream is None and parser_verbose_stream is None
+                  else None)
+    if cache_path is not None and os.path.exists(cache_path):
+        try:
+            with open(cache_path, "rb") as f:
+                return GrammarFromFileProducts(pickle.load(f), None, None)
+        except Exception:
+            pass # Unreadable cache file: parse again and overwrite it
     with open_file(grammar_file) as file:
         tokenizer = Tokenizer.from_stream(file, verbose_stream=tokenizer_verbose_stream)
         parser = GrammarParser(tokenizer, verbose_stream=parser_verbose_stream)
@@ -130,6 +201,8 @@ def load_grammar_from_file(
         grammar = parser.start()
         if grammar is FAILURE:
             raise parser.make_syntax_error("Can't parse grammar file.", grammar_file_name)
+    if cache_path is not None:
+        _write_cache_file(cache_path, pickle.dumps(grammar))
     return GrammarFromFileProducts(grammar, parser, tokenizer)
 
 
@@ -145,7 +218,7 @@ def load_grammar_from_string(
     *,
     grammar_file_name: Optional[str] = None,
 ) -> GrammarFromStringProducts:
-    """Returns BuiltProducts with fields grammar, parser and tokenizer filled."""
+    """Returns GrammarFromStringProducts with fields grammar, grammar_parser and grammar_tokenizer filled."""
     # Note:
     # If a source name of the grammar string (where it comes from)
     # is not given (grammar_file_name is None), use function name as source.
@@ -180,8 +253,8 @@ def generate_code_from_grammar(
             gen.generate(file, grammar_file_name)
             return CodeFromGrammarProducts(gen, file.getvalue())
     else:
-        with open_file(output_file, "w") as file:
-            gen = PythonParserGenerator(grammar, skip_actions=skip_actions)
+        # The generator makes many small writes
+        with open_file(output_file, "w", buffering=1 << 20) as file:
             gen.generate(file, grammar_file_name)
             return CodeFromGrammarProducts(gen, None)
 
@@ -189,20 +262,41 @@ def generate_code_from_grammar(
 class ParserFromCodeProducts(NamedTuple):
     parser_class: Type[BaseParser]
 
+@lru_cache(maxsize=16)
+def _compile_parser_code(parser_code: str) -> CodeType:
+    # Compiling is as costly as generating the code, and the same code
+    # is often executed again (e.g. when a grammar is built repeatedly in tests)
+    if os.environ.get(DISK_CACHE_ENV) != "1":
+        return compile(parser_code, "<string>", "exec")
+    # MAGIC_NUMBER changes whenever the bytecode format does
+    key = hashlib.blake2b(importlib.util.MAGIC_NUMBER + parser_code.encode(),
+                          digest_size=16).hexdigest()
+    path = os.path.join(_cache_dir(), f"parser_{key}.marshal")
+    try:
+        with open(path, "rb") as f:
+            return cast(CodeType, marshal.load(f))
+    except (OSError, EOFError, ValueError, TypeError):
+        pass # Missing or unreadable cache file
+    code = compile(parser_code, "<string>", "exec")
+    _write_cache_file(path, marshal.dumps(code))
+    return code
+
 def generate_parser_from_code(parser_code: str, parser_class_name: str = "GeneratedParser",
                               exec_ns: Optional[dict] = None) -> ParserFromCodeProducts:
     """Warning: generate_parser_from_code evaluates Python code using exec()
     so do not pass it parser code from untrusted sources."""
     if exec_ns is None:
         exec_ns = {}
-    exec(parser_code, exec_ns)
+    exec(_compile_parser_code(parser_code), exec_ns)
     return ParserFromCodeProducts(exec_ns[parser_class_name])
 
 
 class CodeFromFileProducts(NamedTuple):
+    """grammar_parser and grammar_tokenizer are None
+    when the grammar is loaded from the disk cache (see DISK_CACHE_ENV)."""
     grammar: Grammar
-    grammar_parser: BaseParser
-    grammar_tokenizer: Tokenizer
+    grammar_parser: Optional[BaseParser]
+    grammar_tokenizer: Optional[Tokenizer]
     parser_code_generator: ParserGenerator
     parser_code: Optional[str]
 
@@ -216,7 +310,8 @@ def generate_code_from_file(
     grammar_file_name: Optional[str] = None,
 ) -> CodeFromFileProducts:
     grammar_file_name = _grammar_file_name_fallback(grammar_file_name, grammar_file)
-    p = load_grammar_from_file(grammar_file, tokenizer_verbose_stream, parser_verbose_stream)
+    p = load_grammar_from_file(grammar_file, tokenizer_verbose_stream, parser_verbose_stream,
+                               grammar_file_name=grammar_file_name)
     p2 = generate_code_from_grammar(p.grammar, grammar_file_name, output_file,
                                     skip_actions=skip_actions)
     return CodeFromFileProducts(p.grammar, p.grammar_parser, p.grammar_tokenizer,
@@ -227,7 +322,7 @@ class ParserFromGrammarProducts(NamedTuple):
     grammar: Optional[Grammar]
     grammar_parser: Optional[BaseParser]
     grammar_tokenizer: Optional[Tokenizer]
-    parser_code_generator: ParserGenerator
+    parser_code_generator: Optional[ParserGenerator]
     parser_code: str
     parser_class: Type[BaseParser]
 
@@ -244,10 +339,29 @@ def generate_parser_from_grammar(
     exec_ns: Optional[dict] = None,
     *,
     grammar_file_name: Optional[str] = None,
+    cache: bool = False,
+    drop_intermediates: bool = False,
 ) -> ParserFromGrammarProducts:
     """[TODO]
     tokenizer_verbose_stream, verbose_parser and grammar_file_name are only effective when grammar is a str.
+
+    If cache is true and grammar is a str, results are cached (unless exec_ns or a verbose stream
+    is given), so building the same grammar string again returns the same products,
+    including the same parser class.
+
+    If drop_intermediates is true, the grammar, grammar_parser, grammar_tokenizer and
+    parser_code_generator fields are None, so that they can be garbage collected
+    right away when only parser_class (or parser_code) is needed.
+    (Cached results are still kept in full by the cache.)
     """
+    if drop_intermediates:
+        p = generate_parser_from_grammar(
+            grammar, tokenizer_verbose_stream, parser_verbose_stream, skip_actions, exec_ns,
+            grammar_file_name=grammar_file_name, cache=cache)
+        return ParserFromGrammarProducts(None, None, None, None, p.parser_code, p.parser_class)
+    if (cache and isinstance(grammar, str) and exec_ns is None
+            and tokenizer_verbose_stream is None and parser_verbose_stream is None):
+        return _cached_parser_from_grammar_string(grammar, skip_actions, grammar_file_name)
     if grammar_file_name is None:
         grammar_file_name = "<generate_parser_from_grammar>"
     # Grammar string → Grammar
@@ -270,10 +384,31 @@ def generate_parser_from_grammar(
             p2.parser_code, parser_class_name, exec_ns).parser_class)
 
 
+_PARSER_CACHE_MAXSIZE = 128
+# Keyed by a digest of the grammar string, so that the cache doesn't keep grammar sources alive.
+# Least recently used first (a hit moves the entry to the end).
+_parser_cache: Dict[Tuple[bytes, bool, Optional[str]], ParserFromGrammarProducts] = {}
+
+def _cached_parser_from_grammar_string(grammar: str, skip_actions: bool,
+                                       grammar_file_name: Optional[str]) -> ParserFromGrammarProducts:
+    key = (hashlib.blake2b(grammar.encode(), digest_size=16).digest(), skip_actions, grammar_file_name)
+    p = _parser_cache.pop(key, None)
+    if p is None:
+        # A fresh exec_ns bypasses the cache lookup in generate_parser_from_grammar
+        p = generate_parser_from_grammar(grammar, skip_actions=skip_actions, exec_ns={},
+                                         grammar_file_name=grammar_file_name)
+        if len(_parser_cache) >= _PARSER_CACHE_MAXSIZE:
+            del _parser_cache[next(iter(_parser_cache))]
+    _parser_cache[key] = p
+    return p
+
+
 class ParserFromFileProducts(NamedTuple):
+    """grammar_parser and grammar_tokenizer are None
+    when the grammar is loaded from the disk cache (see DISK_CACHE_ENV)."""
     grammar: Grammar
-    grammar_parser: BaseParser
-    grammar_tokenizer: Tokenizer
+    grammar_parser: Optional[BaseParser]
+    grammar_tokenizer: Optional[Tokenizer]
     parser_code_generator: ParserGenerator
     parser_class: Type[BaseParser]
 
@@ -286,6 +421,8 @@ def generate_parser_from_file(
     *,
     grammar_file_name: Optional[str] = None,
 ) -> ParserFromFileProducts:
+    # Resolve the name once, for both loading and the generated parser's header
+    grammar_file_name = _grammar_file_name_fallback(grammar_file_name, grammar_file)
     # Grammar file → Grammar
     p = load_grammar_from_file(
         grammar_file, tokenizer_verbose_stream, parser_verbose_stream, grammar_file_name=grammar_file_name)
@@ -293,6 +430,49 @@ def generate_parser_from_file(
     p2 = generate_parser_from_grammar(
         p.grammar, tokenizer_verbose_stream, parser_verbose_stream, skip_actions,
         exec_ns, grammar_file_name=grammar_file_name)
+    if TYPE_CHECKING: assert p2.parser_code_generator is not None # Not dropped
     return ParserFromFileProducts(p.grammar, p.grammar_parser, p.grammar_tokenizer,
                                      p2.parser_code_generator, p2.parser_class)
 
+
+
+class ParserFromFilesProducts(NamedTuple):
+    grammar: Grammar
+    parser_code: str
+    parser_class: Type[BaseParser]
+
+def _compile_parser_from_file(grammar_file: File, skip_actions: bool) -> Tuple[Grammar, str, bytes]:
+    """Worker of generate_parsers_from_files: returns the grammar,
+    the parser code and its marshalled code object."""
+    p = generate_code_from_file(grammar_file, Flags.RETURN, skip_actions=skip_actions)
+    if TYPE_CHECKING: assert p.parser_code is not None
+    return p.grammar, p.parser_code, marshal.dumps(_compile_parser_code(p.parser_code))
+
+def generate_parsers_from_files(
+    grammar_files: Sequence[File],
+    skip_actions: bool = False,
+    *,
+    max_workers: Optional[int] = None,
+) -> List[ParserFromFilesProducts]:
+    """Generate parser classes for many grammar files in parallel worker processes.
+
+    Grammar loading, code generation and compilation run in the workers;
+    only executing the compiled code to create the parser classes is done here.
+    Runs in this process if any of grammar_files is an opened file (which can't be sent to workers).
+    """
+    work = partial(_compile_parser_from_file, skip_actions=skip_actions)
+    if len(grammar_files) > 1 and all(isinstance(f, (str, bytes)) or hasattr(f, "__fspath__")
+                                      for f in grammar_files):
+        # Imported here as concurrent.futures (with multiprocessing) is slow to import
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(work, grammar_files))
+    else:
+        results = [work(f) for f in grammar_files]
+    products = []
+    for grammar, parser_code, marshalled in results:
+        exec_ns: dict = {}
+        exec(marshal.loads(marshalled), exec_ns)
+        products.append(ParserFromFilesProducts(
+            grammar, parser_code, exec_ns[grammar.metas.get("class", DEFAULT_PARSER_CLASS_NAME)]))
+    return products
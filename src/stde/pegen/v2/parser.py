@@ -1,5 +1,6 @@
 import argparse
 import ast
+from collections import defaultdict
 from enum import Enum
 from functools import partial, wraps
 import sys
@@ -8,7 +9,7 @@ import token
 import tokenize
 import traceback
 from abc import ABC, abstractmethod
-from typing import (TYPE_CHECKING, Any, Callable, ClassVar, Dict, Final, Generic, List, Literal, NamedTuple, Never, Optional,
+from typing import (TYPE_CHECKING, Any, Callable, ClassVar, DefaultDict, Dict, Final, Generic, List, Literal, NamedTuple, Never, Optional,
                     Self, TextIO, Tuple, Type, TypeAlias, TypeVar, Union, cast, Protocol, overload)
 
 from stde.pegen.legacy.tokenizer import Tokenizer
@@ -98,30 +99,34 @@ def memoize(method: F) -> F:
     @wraps(method)
     def memoize_wrapper(self: "BaseParser", *args: object) -> F:
         mark = self.mark()
-        key = (mark, method_name, args)
-        # Fast path: cache hit, and not verbose.
-        if key in self._cache and not self._verbose:
-            tree, endmark = self._cache[key]
+        # Most rules take no arguments, so their mark alone is the key
+        key = (mark, args) if args else mark
+        cache = self._cache[method_name]
+        # Cached values are (tree, endmark) tuples, so None means no cache hit
+        cached = cache.get(key)
+        # Fast path: not verbose, so no logging or level tracking.
+        if not self._verbose:
+            if cached is None:
+                tree = method(self, *args)
+                cache[key] = tree, self.mark()
+                return tree
+            tree, endmark = cached
             self.reset(endmark)
             return tree
-        # Slow path: no cache hit, or verbose.
-        verbose = self._verbose
+        # Slow path: verbose.
         argsr = ",".join(repr(arg) for arg in args)
         fill = "  " * self._level
-        if key not in self._cache:
-            if verbose:
-                self._vprint(f"{fill}{method_name}({argsr}) ... (looking at {self.showpeek()})")
+        if cached is None:
+            self._vprint(f"{fill}{method_name}({argsr}) ... (looking at {self.showpeek()})")
             self._level += 1
             tree = method(self, *args)
             self._level -= 1
-            if verbose:
-                self._vprint(f"{fill}... {method_name}({argsr}) -> {tree!s:.200}")
+            self._vprint(f"{fill}... {method_name}({argsr}) -> {tree!s:.200}")
             endmark = self.mark()
-            self._cache[key] = tree, endmark
+            cache[key] = tree, endmark
         else:
-            tree, endmark = self._cache[key]
-            if verbose:
-                self._vprint(f"{fill}{method_name}({argsr}) -> {tree!s:.200}")
+            tree, endmark = cached
+            self._vprint(f"{fill}{method_name}({argsr}) -> {tree!s:.200}")
             self.reset(endmark)
         return tree
 
@@ -135,16 +140,18 @@ def memoize_left_rec(method: Callable[["BaseParser"], RuleResult[T]]) -> Callabl
     @wraps(method)
     def memoize_left_rec_wrapper(self: "BaseParser") -> RuleResult[T]:
         mark = self.mark()
-        key = (mark, method_name, ())
+        cache = self._cache[method_name]
+        # Cached values are (tree, endmark) tuples, so None means no cache hit
+        cached = cache.get(mark)
+        verbose = self._verbose
         # Fast path: cache hit, and not verbose.
-        if key in self._cache and not self._verbose:
-            tree, endmark = self._cache[key]
+        if cached is not None and not verbose:
+            tree, endmark = cached
             self.reset(endmark)
             return tree
         # Slow path: no cache hit, or verbose.
-        verbose = self._verbose
         fill = "  " * self._level
-        if key not in self._cache:
+        if cached is None:
             if verbose:
                 self._vprint(f"{fill}{method_name} ... (looking at {self.showpeek()})")
             self._level += 1
@@ -158,7 +165,7 @@ def memoize_left_rec(method: Callable[["BaseParser"], RuleResult[T]]) -> Callabl
             # (http://web.cs.ucla.edu/~todd/research/pub.php?id=pepm08).
 
             # Prime the cache with a failure.
-            self._cache[key] = FAILURE, mark
+            cache[mark] = FAILURE, mark
             lastresult: RuleResult[T] # For type checker
             lastresult, lastmark = FAILURE, mark
             depth = 0
@@ -186,7 +193,7 @@ def memoize_left_rec(method: Callable[["BaseParser"], RuleResult[T]]) -> Callabl
                     if verbose:
                         self._vprint(f"{fill}Bailing with {lastresult!s:.200} to {lastmark}")
                     break
-                self._cache[key] = lastresult, lastmark = result, endmark
+                cache[mark] = lastresult, lastmark = result, endmark
 
             self.reset(lastmark)
             tree = lastresult
@@ -199,9 +206,9 @@ def memoize_left_rec(method: Callable[["BaseParser"], RuleResult[T]]) -> Callabl
             else:
                 endmark = mark
                 self.reset(endmark)
-            self._cache[key] = tree, endmark
+            cache[mark] = tree, endmark
         else:
-            tree, endmark = self._cache[key]
+            tree, endmark = cached
             if verbose:
                 self._vprint(f"{fill}{method_name}() -> {tree!s:.200} [fresh]")
             if tree:
@@ -238,7 +245,8 @@ class BaseParser(ABC):
     _verbose: bool
     _vprint: Callable[..., Any] # Should have the same signature as print() #XXX: How to type this?
     """Only present when self._verbose is True"""
-    _cache: Dict[Tuple[Mark, str, Tuple[Any, ...]], Tuple[Any, Mark]] = {}
+    _cache: DefaultDict[str, Dict[Any, Tuple[Any, Mark]]]
+    """Memo cache of each rule method: {method_name: {mark or (mark, args): (tree, endmark)}}"""
     _level: int
     in_recursive_rule: int
 
@@ -251,7 +259,7 @@ class BaseParser(ABC):
         if self._verbose:
             self._vprint = partial(print, file=verbose_stream)
         self._level = 0
-        self._cache = {}
+        self._cache = defaultdict(dict)
 
         # Integer tracking wether we are in a left recursive rule or not. Can be useful
         # for error reporting.
@@ -669,14 +677,16 @@ class CharBasedParser(BaseParser):
         self._update_farthest(self.mark())
         return char
 
-    @memoize
+    # Not memoized: a cache lookup costs more than the startswith
     def match_string(self, s: str) -> RuleResult[str]:
         if not self._text.startswith(s, self._pos):
             return FAILURE
-        nlines, last_col = _count_nlines_and_last_col(s)
         self._pos += len(s)
-        self._line += nlines
-        self._col = last_col if nlines else self._col + len(s)
+        if "\n" in s or "\r" in s:
+            nlines, self._col = _count_nlines_and_last_col(s)
+            self._line += nlines
+        else:
+            self._col += len(s)
         self._update_farthest(self.mark())
         return s
 
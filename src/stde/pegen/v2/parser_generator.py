@@ -112,11 +112,11 @@ class ParserGenerator:
             self.level -= 1
 
     def print(self, *args: object) -> None:
+        # Same output as print(), but with a single write per line
         if not args:
-            print(file=self.file)
+            self.file.write("\n")
         else:
-            print("    " * self.level, end="", file=self.file)
-            print(*args, file=self.file)
+            self.file.write("    " * self.level + " ".join(map(str, args)) + "\n")
 
     def printblock(self, lines: str) -> None:
         for line in lines.splitlines():
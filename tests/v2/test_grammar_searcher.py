@@ -0,0 +1,16 @@
+import pytest
+
+from scripts import grammar_searcher
+
+
+def test_parse_query() -> None:
+    query = grammar_searcher._parse_query("'==':<=3")
+    assert query.item == grammar_searcher.Item(grammar_searcher.ItemType.STRING, "==")
+    assert query.limit == 3
+
+def test_query_syntax_error_position() -> None:
+    with pytest.raises(SyntaxError) as excinfo:
+        grammar_searcher._parse_query("bad query")
+    # CharBasedParser reports the farthest position reached (just after "bad") as lineno;
+    # failing to match a letter at the space must not advance it
+    assert excinfo.value.lineno == 3
@@ -1,6 +1,7 @@
 import sys
 import token
 import traceback
+from pathlib import Path
 
 from stde.pegen.v2.parser import FAILURE
 import pytest
@@ -65,4 +66,54 @@ def test_one_line_indent() -> None:
     """)
     p = generate_parser_from_grammar(grammar)
     #print(p.parser_code)
-    assert p.parser_class.from_text("hello", verbose_stream=sys.stdout).start().string == "hello" #type:ignore[union-attr]
\ No newline at end of file
+    assert p.parser_class.from_text("hello", verbose_stream=sys.stdout).start().string == "hello" #type:ignore[union-attr]
+
+def test_grammar_cache(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    from stde.pegen.v2.build import DISK_CACHE_ENV, load_grammar_from_file
+    monkeypatch.setenv(DISK_CACHE_ENV, "1")
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    grammar_file = tmp_path / "grammar.gram"
+    grammar_file.write_text("start: NAME NEWLINE $\n")
+    p = load_grammar_from_file(grammar_file)
+    assert p.grammar_parser is not None
+    p2 = load_grammar_from_file(grammar_file)
+    assert p2.grammar_parser is None and p2.grammar_tokenizer is None
+    assert str(p2.grammar) == str(p.grammar)
+
+def test_compiled_parser_code_cache(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    from stde.pegen.v2.build import DISK_CACHE_ENV, _compile_parser_code
+    monkeypatch.setenv(DISK_CACHE_ENV, "1")
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    compile_uncached = _compile_parser_code.__wrapped__  # Bypass the in-memory cache
+    code = compile_uncached("x = 1\n")
+    assert len(list((tmp_path / "cache" / "stde.pegen").glob("parser_*.marshal"))) == 1
+    assert compile_uncached("x = 1\n") == code
+
+def test_parser_from_grammar_string_cache() -> None:
+    grammar = "start: NAME NEWLINE $\n"
+    p = generate_parser_from_grammar(grammar, cache=True)
+    assert generate_parser_from_grammar(grammar, cache=True) == p
+    assert p.grammar_parser is not None and p.grammar_tokenizer is not None
+    assert generate_parser_from_grammar(grammar).parser_class is not p.parser_class
+    assert generate_parser_from_grammar(grammar, cache=True, exec_ns={}).parser_class is not p.parser_class
+    assert generate_parser_from_grammar(grammar, cache=True, skip_actions=True).parser_class is not p.parser_class
+
+def test_drop_intermediates() -> None:
+    grammar = "start: NAME NEWLINE $\n"
+    p = generate_parser_from_grammar(grammar, drop_intermediates=True)
+    assert p.grammar is None and p.grammar_parser is None and p.grammar_tokenizer is None
+    assert p.parser_code_generator is None
+    assert p.parser_class.from_text("hello").start() is not FAILURE
+    p2 = generate_parser_from_grammar(grammar)
+    assert None not in (p2.grammar, p2.grammar_parser, p2.grammar_tokenizer, p2.parser_code_generator)
+
+def test_generate_parsers_from_files(tmp_path: Path) -> None:
+    from stde.pegen.v2.build import generate_parsers_from_files
+    files = []
+    for i, grammar in enumerate(["start: NAME NEWLINE $\n", "@class P\nstart: NUMBER NEWLINE $\n"]):
+        files.append(tmp_path / f"g{i}.gram")
+        files[-1].write_text(grammar)
+    p1, p2 = generate_parsers_from_files(files)
+    assert p1.parser_class.from_text("hello").start() is not FAILURE
+    assert p2.parser_class.__name__ == "P"
+    assert p2.parser_class.from_text("hello").start() is FAILURE